@@ -3,9 +3,19 @@ Clone Dance - Configuration File
 Loads configuration from config.json for all modules.
 """
 
+import copy
 import json
+import threading
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
+
+
+# Parsed config files keyed by (path, mtime_ns, size, inode), so repeated
+# loads skip the read + parse while in-place edits still invalidate.
+# Cache hits share the stored dict; treat loaded config as read-only unless
+# it is saved back with Config.save().
+_CACHE: Dict[Tuple[str, int, int, int], Dict[str, Any]] = {}
+_CACHE_LOCK = threading.Lock()
 
 
 class Config:
@@ -24,14 +34,27 @@ class Config:
         if not path.exists():
             raise FileNotFoundError(f"Config not found: {filepath}")
 
-        with path.open('r', encoding='utf-8') as f:
-            data = json.load(f)
+        st = path.stat()
+        sig = (str(path.resolve()), st.st_mtime_ns, st.st_size, st.st_ino)
+
+        with _CACHE_LOCK:
+            cached = _CACHE.get(sig)
+
+        if cached is not None:
+            data = cached
+        else:
+            with path.open('r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            if not isinstance(data, dict):
+                raise ValueError("Config file must be a JSON object")
 
-        if not isinstance(data, dict):
-            raise ValueError("Config file must be a JSON object")
+            if 'common' not in data or 'game' not in data or 'visualizer' not in data:
+                raise ValueError("Config file must include common, game, and visualizer sections")
 
-        if 'common' not in data or 'game' not in data or 'visualizer' not in data:
-            raise ValueError("Config file must include common, game, and visualizer sections")
+            # Copied once on insert, so edits by this first caller don't leak into the cache
+            with _CACHE_LOCK:
+                _CACHE[sig] = copy.deepcopy(data)
 
         cls._config = data
         cls._path = path
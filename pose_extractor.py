@@ -9,16 +9,322 @@ from mediapipe.tasks import python
 from mediapipe.tasks.python import vision
 import numpy as np
 import json
+import functools
+import hashlib
+import math
+import os
+import platform
+import statistics
+import time
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Iterator, Optional, Tuple
 from collections import deque
 import logging
+import queue
+import threading
 
 from config import Config
 
+try:
+    import av
+except ImportError:  # PyAV is optional; OpenCV decodes otherwise
+    av = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# MediaPipe Pose Landmarker always returns 33 landmarks per pose
+NUM_LANDMARKS = 33
+
+# Model variants ordered from cheapest to most accurate
+MODEL_COMPLEXITIES = ('lite', 'full', 'heavy')
+
+# Per-hardware result of calibrate_model_complexity()
+CALIBRATION_FILE = 'model_calibration.json'
+
+# Max frames buffered between extraction pipeline stages
+PIPELINE_QUEUE_SIZE = 4
+
+# Max extracted poses buffered for the consumer; poses are small, so
+# detection can run well ahead of a slow writer
+POSE_QUEUE_SIZE = 256
+
+# Timestamp jump between consecutive videos on one detector. VIDEO mode only
+# needs increasing timestamps; the gap does not reset tracking, so the first
+# frame of the next video may still be tracked from the previous video's
+# last pose region.
+VIDEO_GAP_MS = 60_000
+
+# Storage types for the .npz pose arrays; i16 is fixed point
+NPZ_PRECISIONS = ('i16', 'f16', 'f32')
+
+# Fixed-point scales of the i16 .npz pose arrays
+LANDMARK_SCALE = 10_000
+ANGLE_SCALE = 100
+# Stored for angles that were not computed (None in JSON)
+ANGLE_MISSING = np.iinfo(np.uint16).max
+
+# Last timestamp fed to each detector, by id(detector)
+_last_timestamp_ms: Dict[int, int] = {}
+
+# One landmark as a record, so a whole pose is filled by a single np.fromiter
+_LANDMARK_DTYPE = np.dtype([
+    ('x', np.float32), ('y', np.float32), ('z', np.float32), ('visibility', np.float32)
+])
+
+
+def pack_landmarks(pose_landmarks, out: np.ndarray) -> np.ndarray:
+    """Copy MediaPipe landmarks into a (33, 4) float32 array (x, y, z, visibility)."""
+    count = len(pose_landmarks)
+    out.view(_LANDMARK_DTYPE)[:count, 0] = np.fromiter(
+        ((lm.x, lm.y, lm.z, lm.visibility) for lm in pose_landmarks),
+        dtype=_LANDMARK_DTYPE,
+        count=count
+    )
+    return out
+
+
+@functools.lru_cache(maxsize=4)
+def _make_landmarker(model_path: str, use_gpu: bool, detection_conf: float,
+                     presence_conf: float, tracking_conf: float):
+    """
+    Create a VIDEO-mode PoseLandmarker, on the GPU delegate if requested and
+    available. Cached, so extractors that opt in with shared_detector=True
+    share one model instead of loading it again.
+    """
+    def build_options(delegate) -> vision.PoseLandmarkerOptions:
+        return vision.PoseLandmarkerOptions(
+            base_options=python.BaseOptions(model_asset_path=model_path, delegate=delegate),
+            # Not LIVE_STREAM: detect_async drops frames while the model is busy,
+            # and every kept frame must be scored. Decode and preprocessing
+            # already overlap inference through the iter_poses() pipeline.
+            running_mode=vision.RunningMode.VIDEO,
+            num_poses=1,
+            min_pose_detection_confidence=detection_conf,
+            min_pose_presence_confidence=presence_conf,
+            min_tracking_confidence=tracking_conf,
+            output_segmentation_masks=False
+        )
+    
+    if use_gpu:
+        try:
+            detector = vision.PoseLandmarker.create_from_options(build_options(python.BaseOptions.Delegate.GPU))
+            logger.info("Using GPU delegate")
+            return detector
+        except (RuntimeError, NotImplementedError) as e:
+            # Not every mediapipe build/platform ships the GPU delegate
+            logger.warning("GPU delegate unavailable, using CPU: %s", e)
+    
+    return vision.PoseLandmarker.create_from_options(build_options(python.BaseOptions.Delegate.CPU))
+
+
+def active_landmark_ids() -> List[int]:
+    """
+    ACTIVE_LANDMARKS ids that exist in a MediaPipe pose, in stored row order.
+    Computed once per PoseExtractor (see PoseExtractor.active_landmark_ids).
+    """
+    return [i for i in Config.ACTIVE_LANDMARKS if i < NUM_LANDMARKS]
+
+
+def landmarks_to_json(active_lm: np.ndarray, landmark_ids: List[int]) -> List[Dict]:
+    """Convert an (A, 4) array of active landmark rows to JSON format, re-attaching their ids"""
+    rows = np.round(active_lm.astype(np.float64), 4).tolist()
+    
+    return [
+        {'id': i, 'x': x, 'y': y, 'z': z, 'visibility': visibility}
+        for i, (x, y, z, visibility) in zip(landmark_ids, rows)
+    ]
+
+
+def angles_to_json(angles: np.ndarray) -> Dict[str, Optional[float]]:
+    """Convert an ANGLE_JOINTS-ordered angle array (NaN = not computed) to JSON format"""
+    rounded = np.round(angles.astype(np.float64), 2).tolist()
+    return {
+        name: None if math.isnan(angle) else angle
+        for name, angle in zip(Config.ANGLE_JOINTS, rounded)
+    }
+
+
+def pose_to_json(pose: Dict, landmark_ids: List[int]) -> Dict:
+    """
+    Convert an extracted pose to the JSON layout of choreography files.
+    Rounding happens here, once per pose, rather than on every extracted value.
+    
+    Args:
+        pose: Pose from PoseExtractor.iter_poses()
+        landmark_ids: Ids of the pose's landmark rows (the extractor's active_landmark_ids)
+    """
+    return {
+        'timestamp': round(pose['timestamp'], 3),
+        'frame': pose['frame'],
+        'landmarks': landmarks_to_json(pose['landmarks'], landmark_ids),
+        'angles': angles_to_json(pose['angles'])
+    }
+
+
+class QuantizedPoses:
+    """
+    Reduced-precision copy of extracted poses for the compact .npz output.
+    With 'i16', landmarks are int16 (value * LANDMARK_SCALE) and angles
+    uint16 (degrees * ANGLE_SCALE, ANGLE_MISSING where not computed).
+    With 'f16'/'f32', both are floats with NaN for missing angles and
+    scales of 1. Timestamps are always int32 milliseconds.
+    """
+    
+    def __init__(self, landmark_ids: List[int], precision: str = 'i16', capacity: int = 0):
+        """
+        Args:
+            landmark_ids: Ids of the poses' landmark rows (the extractor's active_landmark_ids)
+            precision: 'i16', 'f16' or 'f32'
+            capacity: Expected number of poses; arrays are preallocated for
+                this many and grow if more arrive
+        """
+        if precision not in NPZ_PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision} (expected one of {', '.join(NPZ_PRECISIONS)})")
+        
+        self.precision = precision
+        self.landmark_ids = landmark_ids
+        self._count = 0
+        
+        if precision == 'i16':
+            landmark_dtype, angle_dtype = np.int16, np.uint16
+        else:
+            landmark_dtype = angle_dtype = np.float16 if precision == 'f16' else np.float32
+        
+        capacity = max(0, capacity)
+        self.timestamps_ms = np.empty(capacity, dtype=np.int32)
+        self.frames = np.empty(capacity, dtype=np.int32)
+        self.landmarks = np.empty((capacity, len(landmark_ids), 4), dtype=landmark_dtype)
+        self.angles = np.empty((capacity, len(Config.ANGLE_JOINTS)), dtype=angle_dtype)
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    def _grow(self) -> None:
+        """Double the capacity, for videos whose frame count was underreported"""
+        capacity = max(64, 2 * len(self.frames))
+        for name in ('timestamps_ms', 'frames', 'landmarks', 'angles'):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._count] = old[:self._count]
+            setattr(self, name, new)
+    
+    def append(self, pose: Dict) -> None:
+        """Quantize and store one pose from PoseExtractor.iter_poses()"""
+        if self._count == len(self.frames):
+            self._grow()
+        
+        i = self._count
+        landmarks = pose['landmarks']
+        angles = pose['angles']
+        
+        self.timestamps_ms[i] = round(pose['timestamp'] * 1000)
+        self.frames[i] = pose['frame']
+        
+        # Assigning into the preallocated rows casts to their storage type
+        if self.precision == 'i16':
+            # z and off-screen x/y can leave [0, 1]; clip instead of wrapping around
+            int16 = np.iinfo(np.int16)
+            self.landmarks[i] = np.clip(np.rint(landmarks * LANDMARK_SCALE), int16.min, int16.max)
+            self.angles[i] = np.where(np.isnan(angles), ANGLE_MISSING, np.rint(angles * ANGLE_SCALE))
+        else:
+            self.landmarks[i] = landmarks
+            self.angles[i] = angles
+        
+        self._count += 1
+    
+    def save(self, file) -> None:
+        """Write the poses with np.savez_compressed to a path or binary file object"""
+        fixed_point = self.precision == 'i16'
+        n = self._count
+        np.savez_compressed(
+            file,
+            timestamps_ms=self.timestamps_ms[:n],
+            frames=self.frames[:n],
+            landmarks=self.landmarks[:n],
+            angles=self.angles[:n],
+            landmark_ids=np.asarray(self.landmark_ids, dtype=np.int16),
+            angle_names=np.asarray(list(Config.ANGLE_JOINTS)),
+            landmark_scale=LANDMARK_SCALE if fixed_point else 1,
+            angle_scale=ANGLE_SCALE if fixed_point else 1
+        )
+
+
+def compute_angles(xy: np.ndarray, triplets: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """
+    Angle in degrees at the vertex of each (p1, vertex, p2) triplet.
+    
+    Args:
+        xy: (33, 2) landmark coordinates
+        triplets: (N, 3) landmark ids as p1, vertex, p2
+        out: (N,) float32 buffer that receives the angles
+    """
+    pts = xy[triplets]                           # (N, 3, 2)
+    vecs = pts[:, ::2] - pts[:, 1:2]             # (N, 2, 2): vertex->p1, vertex->p2
+    
+    # Angle using dot product; the cosine is turned into degrees in place
+    np.einsum('nd,nd->n', vecs[:, 0], vecs[:, 1], out=out)
+    norms = np.sqrt(np.einsum('nkd,nkd->nk', vecs, vecs)).prod(axis=1)
+    norms += 1e-8
+    out /= norms
+    np.clip(out, -1.0, 1.0, out=out)
+    np.arccos(out, out=out)
+    np.degrees(out, out=out)
+    return out
+
+
+def _queue_put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Put item on q, giving up if stop is set while the queue is full"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain_queue(q: queue.Queue, stop: threading.Event):
+    """Yield items from q until the None sentinel arrives or stop is set"""
+    while not stop.is_set():
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is None:
+            return
+        yield item
+
+
+def _upright(image: np.ndarray, rotation: int) -> np.ndarray:
+    """
+    Apply a PyAV frame's display-matrix rotation (degrees counterclockwise),
+    as OpenCV's FFmpeg backend does automatically.
+    """
+    turns = round(rotation / 90) % 4
+    if turns == 0:
+        return image
+    return np.ascontiguousarray(np.rot90(image, turns))
+
+
+def _log_progress(frame_count: int, total_frames: int) -> None:
+    """Log decoding progress every 100 frames"""
+    if frame_count % 100 == 0 and total_frames > 0 and logger.isEnabledFor(logging.INFO):
+        progress = (frame_count / total_frames) * 100
+        logger.info("   Progress: %.1f%% (%d/%d)", progress, frame_count, total_frames)
+
+
+def _run_stage(items, out_q: queue.Queue, stop: threading.Event, errors: list) -> None:
+    """Pipeline thread body: push every item to out_q, then the None sentinel"""
+    try:
+        for item in items:
+            if not _queue_put(out_q, item, stop):
+                return
+    except Exception as e:
+        errors.append(e)
+    finally:
+        _queue_put(out_q, None, stop)
+
 
 class PoseExtractor:
     """
@@ -29,38 +335,93 @@ class PoseExtractor:
     
     def __init__(self, 
                  model_path: Optional[str] = None,
-                 model_complexity: str = None):
+                 model_complexity: str = None,
+                 decode_threads: Optional[int] = None,
+                 shared_detector: bool = False):
         """
         Initialize pose extractor.
         
         Args:
             model_path: Path to .task model file
-            model_complexity: 'lite', 'full', or 'heavy'
+            model_complexity: 'lite', 'full', or 'heavy' ('auto' must be
+                resolved with calibrate_model_complexity() beforehand)
+            decode_threads: FFmpeg threads for the PyAV decoder (default: half the CPUs)
+            shared_detector: Reuse the cached landmarker for these settings
+                instead of loading a private one (closed with close()). A
+                shared landmarker keeps one timeline, so extractors sharing it
+                must not run iter_poses() at the same time.
         """
         Config.ensure_loaded()
         self.model_complexity = model_complexity or Config.MODEL_COMPLEXITY
         
+        if self.model_complexity == 'auto':
+            raise ValueError(
+                "model_complexity 'auto' must be resolved with calibrate_model_complexity() first"
+            )
+        
         if model_path is None:
             model_path = Config.MODEL_PATH or f'pose_landmarker_{self.model_complexity}.task'
         
         model_path = self._ensure_model_exists(model_path, self.model_complexity)
         
-        base_options = python.BaseOptions(model_asset_path=model_path)
-        
-        self.options = vision.PoseLandmarkerOptions(
-            base_options=base_options,
-            running_mode=vision.RunningMode.VIDEO,
-            num_poses=1,
-            min_pose_detection_confidence=Config.MIN_DETECTION_CONFIDENCE,
-            min_pose_presence_confidence=Config.MIN_PRESENCE_CONFIDENCE,
-            min_tracking_confidence=Config.MIN_TRACKING_CONFIDENCE,
-            output_segmentation_masks=False
+        # With shared_detector, extractors with the same settings share a landmarker
+        self._landmarker_args = (
+            model_path,
+            Config.USE_GPU_DELEGATE,
+            Config.MIN_DETECTION_CONFIDENCE,
+            Config.MIN_PRESENCE_CONFIDENCE,
+            Config.MIN_TRACKING_CONFIDENCE
         )
-        
-        self.detector = vision.PoseLandmarker.create_from_options(self.options)
-        
-        
-        logger.info(f"PoseLandmarkerExtractor initialized with model: {self.model_complexity}")
+        if shared_detector:
+            self.detector = _make_landmarker(*self._landmarker_args)
+        else:
+            self.detector = _make_landmarker.__wrapped__(*self._landmarker_args)
+        self._owns_detector = not shared_detector
+        # Added to every timestamp so the shared detector never sees them rewind
+        self._ts_offset_ms = 0
+        
+        # Scratch buffer reused for every frame's landmark conversion
+        self._lm_buf = np.empty((NUM_LANDMARKS, 4), dtype=np.float32)
+        # Rows kept per pose; a fancy index also copies them out of the scratch buffer
+        self.active_landmark_ids = active_landmark_ids()
+        self._active_idx = np.asarray(self.active_landmark_ids, dtype=np.int64)
+        # PyAV decodes with frame threads and outputs RGB directly
+        self._decoder = Config.DECODER
+        self._decode_threads = decode_threads or max(1, (os.cpu_count() or 2) // 2)
+        if self._decoder == 'pyav' and av is None:
+            logger.warning("DECODER is 'pyav' but PyAV is not installed; using OpenCV")
+            self._decoder = 'opencv'
+        elif self._decoder == 'pyav' and not hasattr(av.VideoFrame, 'rotation'):
+            # Without it, rotated (e.g. portrait phone) videos would reach the model sideways
+            logger.warning("DECODER is 'pyav' but this PyAV cannot read frame rotation; using OpenCV")
+            self._decoder = 'opencv'
+        
+        # Downscaled, RGB and mirrored frame buffers, allocated on the first
+        # frame once the size is known
+        self._frame_shape = None
+        self._resize_buf = None
+        self._rgb_buf = None
+        self._flip_buf = None
+        
+        # Angle triplets (p1, vertex, p2) as one index array for vectorized angles
+        # Joints using a landmark outside ACTIVE_LANDMARKS are dropped here once
+        # and always come out as NaN
+        self._angle_names = list(Config.ANGLE_JOINTS.keys())
+        active = set(Config.ACTIVE_LANDMARKS)
+        computable = []
+        for pos, (name, triplet) in enumerate(Config.ANGLE_JOINTS.items()):
+            if all(i in active for i in triplet):
+                computable.append(pos)
+            else:
+                logger.warning("Angle '%s' uses landmarks outside ACTIVE_LANDMARKS; it will not be computed", name)
+        self._angle_pos = np.array(computable, dtype=np.int64)
+        self._angle_idx = np.array(
+            [Config.ANGLE_JOINTS[self._angle_names[pos]] for pos in computable],
+            dtype=np.int64
+        ).reshape(-1, 3)
+        self._angle_buf = np.empty(len(computable), dtype=np.float32)
+        
+        logger.info("PoseLandmarkerExtractor initialized with model: %s", self.model_complexity)
     
     def _ensure_model_exists(self, model_path: str, complexity: str) -> str:
         """Check if model exists, provide download instructions if not"""
@@ -71,8 +432,8 @@ class PoseExtractor:
         if Path(default_name).exists():
             return default_name
         
-        logger.error(f"Model not found: {model_path}")
-        logger.info(f"Download the model with:")
+        logger.error("Model not found: %s", model_path)
+        logger.info("Download the model with:")
         
         urls = {
             'lite': 'https://storage.googleapis.com/mediapipe-models/pose_landmarker/pose_landmarker_lite/float16/latest/pose_landmarker_lite.task',
@@ -80,38 +441,40 @@ class PoseExtractor:
             'heavy': 'https://storage.googleapis.com/mediapipe-models/pose_landmarker/pose_landmarker_heavy/float16/latest/pose_landmarker_heavy.task'
         }
         
-        logger.info(f"wget {urls[complexity]}")
+        logger.info("wget %s", urls[complexity])
         
         raise FileNotFoundError(
             f"Model not found. Please download:\nwget {urls[complexity]}"
         )
     
-    def extract_from_video(self, video_path: str, skip_frames: int = None) -> Dict:
+    def read_metadata(self, video_path: str) -> Dict:
         """
-        Extract all poses from a video with position and angles
+        Read video properties without decoding any frame
         
         Args:
             video_path: Path to video file
-            skip_frames: Skip N frames (None = use Config.SKIP_FRAMES)
         
         Returns:
-            Dict with metadata and pose list
+            Dict with fps, frame count, duration, resolution and extraction settings
         """
         if not Path(video_path).exists():
             raise FileNotFoundError(f"Video not found: {video_path}")
         
-        if skip_frames is None:
-            skip_frames = Config.SKIP_FRAMES
-        
         cap = cv2.VideoCapture(video_path)
-        
+        try:
+            return self._video_metadata(cap)
+        finally:
+            cap.release()
+    
+    def _video_metadata(self, cap) -> Dict:
+        """Build the metadata dict from an open capture"""
         fps = cap.get(cv2.CAP_PROP_FPS)
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         duration = total_frames / fps if fps > 0 else 0
         
-        metadata = {
+        return {
             'fps': fps,
             'total_frames': total_frames,
             'duration': duration,
@@ -120,159 +483,313 @@ class PoseExtractor:
             'active_landmarks': Config.ACTIVE_LANDMARKS,
             'mirror_mode': Config.MIRROR_REFERENCE
         }
+    
+    def extract_from_video(self, video_path: str, skip_frames: int = None) -> Dict:
+        """
+        Extract all poses from a video with position and angles
         
-        logger.info(f"Processing video: {video_path}")
-        logger.info(f"   FPS: {fps:.1f}, Frames: {total_frames}, Duration: {duration:.1f}s")
+        Args:
+            video_path: Path to video file
+            skip_frames: Skip N frames (None = use Config.SKIP_FRAMES)
         
-        poses = []
-        frame_count = 0
-        processed_count = 0
-        failed_count = 0
+        Returns:
+            Dict with metadata and pose list (active landmarks and angles as
+            float32 arrays; see pose_to_json())
+        """
+        metadata = self.read_metadata(video_path)
+        
+        return {
+            'metadata': metadata,
+            'poses': list(self.iter_poses(video_path, skip_frames))
+        }
+    
+    def iter_poses(self, video_path: str, skip_frames: int = None) -> Iterator[Dict]:
+        """
+        Extract poses from a video one at a time, as each frame is processed.
+        Lets callers write results out incrementally instead of holding the
+        whole video in memory.
+        
+        Args:
+            video_path: Path to video file
+            skip_frames: Skip N frames (None = use Config.SKIP_FRAMES)
+        
+        Yields:
+            Pose dicts (active landmarks and angles as float32 arrays; see pose_to_json())
+        """
+        if not Path(video_path).exists():
+            raise FileNotFoundError(f"Video not found: {video_path}")
+        
+        if skip_frames is None:
+            skip_frames = Config.SKIP_FRAMES
+        
+        cap = cv2.VideoCapture(video_path)
+        metadata = self._video_metadata(cap)
+        fps = metadata['fps']
+        total_frames = metadata['total_frames']
+        
+        logger.info("Processing video: %s", video_path)
+        logger.info("   FPS: %.1f, Frames: %d, Duration: %.1fs", fps, total_frames, metadata['duration'])
+        
+        counts = {'processed': 0, 'failed': 0}
+        self._start_timeline()
+        
+        # Decode -> preprocess -> detect pipeline: the next frames are decoded
+        # and converted to RGB while MediaPipe runs inference on this one, and
+        # the caller consumes (e.g. writes) earlier poses in the meantime.
+        stop = threading.Event()
+        errors = []
+        frames_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        images_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        poses_q = queue.Queue(maxsize=POSE_QUEUE_SIZE)
+        
+        if self._decoder == 'pyav':
+            cap.release()
+            frames = self._read_frames_pyav(video_path, fps, total_frames, skip_frames)
+        else:
+            frames = self._read_frames(cap, fps, total_frames, skip_frames)
+        is_rgb = self._decoder == 'pyav'
+        
+        stages = [
+            threading.Thread(
+                target=_run_stage,
+                args=(frames, frames_q, stop, errors),
+                daemon=True
+            ),
+            threading.Thread(
+                target=_run_stage,
+                args=(self._preprocess_frames(_drain_queue(frames_q, stop), is_rgb), images_q, stop, errors),
+                daemon=True
+            ),
+            threading.Thread(
+                target=_run_stage,
+                args=(self._detect_frames(_drain_queue(images_q, stop), fps, counts), poses_q, stop, errors),
+                daemon=True
+            )
+        ]
+        for stage in stages:
+            stage.start()
+        
+        try:
+            yield from _drain_queue(poses_q, stop)
+        finally:
+            stop.set()
+            for stage in stages:
+                stage.join()
+            cap.release()
+        
+        if errors:
+            raise errors[0]
+        
+        processed_count = counts['processed']
+        failed_count = counts['failed']
+        attempted = processed_count + failed_count
+        logger.info("Extraction completed:")
+        logger.info("   Processed: %d, Failed: %d", processed_count, failed_count)
+        if attempted:
+            logger.info("   Success rate: %.1f%%", (processed_count/attempted)*100)
+    
+    def max_poses(self, metadata: Dict, skip_frames: int = None) -> int:
+        """
+        Upper bound on the poses iter_poses() yields for a video, from its
+        reported frame count.
+        
+        Args:
+            metadata: Result of read_metadata()
+            skip_frames: Skip N frames (None = use Config.SKIP_FRAMES)
+        """
+        if skip_frames is None:
+            skip_frames = Config.SKIP_FRAMES
+        
+        stride = self._frame_stride(metadata['fps'], skip_frames)
+        return -(-metadata['total_frames'] // stride)
+    
+    def _frame_stride(self, fps: float, skip_frames: int) -> int:
+        """
+        Keep one frame every N, combining skip_frames with the TARGET_FPS limit.
+        A frame is kept only if both would keep it, hence the LCM of the strides.
+        """
+        # Negative values process every frame, as skip_frames <= 0 always has
+        stride = max(0, skip_frames) + 1
+        
+        if Config.TARGET_FPS and fps > 0:
+            stride = math.lcm(stride, max(1, round(fps / Config.TARGET_FPS)))
         
+        return stride
+    
+    def _read_frames(self, cap, fps: float, total_frames: int, skip_frames: int):
+        """Decoder stage: yield (frame, frame_number) for the frames to process"""
+        frame_count = 0
+        stride = self._frame_stride(fps, skip_frames)
         
         while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
+            # grab() demuxes and decodes; the BGR conversion and copy in
+            # retrieve() is only paid for frames that are kept
+            if not cap.grab():
                 break
             
-            # Skip frames if specified
-            if skip_frames > 0 and frame_count % (skip_frames + 1) != 0:
-                frame_count += 1
-                continue
+            if frame_count % stride == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                yield frame, frame_count
             
-            # Apply FPS limit if specified
-            if Config.TARGET_FPS is not None:
-                target_interval = 1.0 / Config.TARGET_FPS
-                actual_interval = 1.0 / fps
-                if frame_count * actual_interval % target_interval < actual_interval:
-                    frame_count += 1
-                    continue
+            frame_count += 1
+            _log_progress(frame_count, total_frames)
+    
+    def _read_frames_pyav(self, video_path: str, fps: float, total_frames: int, skip_frames: int):
+        """Decoder stage using PyAV: yield (RGB frame, frame_number) for the frames to process"""
+        stride = self._frame_stride(fps, skip_frames)
+        container = av.open(video_path)
+        
+        try:
+            stream = container.streams.video[0]
+            # Frame-threaded FFmpeg decode; the rest of the cores run the pipeline and inference
+            stream.thread_type = 'AUTO'
+            stream.thread_count = self._decode_threads
             
-            # Process frame
-            pose_data = self._process_frame(frame, frame_count, fps)
+            for frame_count, frame in enumerate(container.decode(stream)):
+                # Dropped frames are never converted out of the decoder's YUV
+                # surface. A select/fps filter graph would not do better: inter
+                # frames depend on their neighbours, so FFmpeg decodes every
+                # frame before a filter sees it. Decoding into RGB replaces
+                # the cvtColor in preprocessing.
+                if frame_count % stride == 0:
+                    yield _upright(frame.to_ndarray(format='rgb24'), frame.rotation), frame_count
+                _log_progress(frame_count + 1, total_frames)
+        finally:
+            container.close()
+    
+    def _preprocess_frames(self, frames, is_rgb: bool = False):
+        """Preprocessing stage: yield (mp_image, frame_number) from decoded frames"""
+        for frame, frame_number in frames:
+            yield self._to_mp_image(frame, is_rgb), frame_number
+    
+    def _detect_frames(self, images, fps: float, counts: Dict[str, int]):
+        """Detection stage: yield a pose for every frame where one is found, counting misses"""
+        for mp_image, frame_number in images:
+            pose_data = self._process_frame(mp_image, frame_number, fps)
             
             if pose_data:
-                poses.append(pose_data)
-                processed_count += 1
+                counts['processed'] += 1
+                yield pose_data
             else:
-                failed_count += 1
-            
-            frame_count += 1
-            
-            if frame_count % 100 == 0:
-                progress = (frame_count / total_frames) * 100
-                logger.info(f"   Progress: {progress:.1f}% ({frame_count}/{total_frames})")
-        
-        cap.release()
+                counts['failed'] += 1
+    
+    def _detect(self, mp_image: mp.Image, timestamp_ms: int):
+        """Run VIDEO-mode detection, offsetting the timestamp for the shared detector"""
+        timestamp_ms += self._ts_offset_ms
+        detection_result = self.detector.detect_for_video(mp_image, timestamp_ms)
+        _last_timestamp_ms[id(self.detector)] = timestamp_ms
+        return detection_result
+    
+    def _start_timeline(self) -> None:
+        """Continue after the last timestamp the detector has seen, so a new video never rewinds"""
+        last = _last_timestamp_ms.get(id(self.detector))
+        self._ts_offset_ms = 0 if last is None else last + VIDEO_GAP_MS
+    
+    def reset(self) -> None:
+        """
+        Replace the detector with a fresh, unshared one. Needed only when
+        timestamps have to rewind; clears tracking state.
+        """
+        self._close_detector()
+        self.detector = _make_landmarker.__wrapped__(*self._landmarker_args)
+        self._owns_detector = True
+        self._ts_offset_ms = 0
+    
+    def close(self) -> None:
+        """Release the detector now if it is not shared with other extractors"""
+        self._close_detector()
+    
+    def _close_detector(self) -> None:
+        """Close the detector if it is not shared with other extractors"""
+        if getattr(self, '_owns_detector', False):
+            _last_timestamp_ms.pop(id(self.detector), None)
+            self.detector.close()
+            self._owns_detector = False
+    
+    def _preprocess_shape(self, shape: Tuple[int, ...]) -> Tuple[int, ...]:
+        """Frame shape after downscaling to Config.PREPROCESS_MAX_WIDTH, keeping the aspect ratio"""
+        height, width = shape[:2]
+        max_width = Config.PREPROCESS_MAX_WIDTH
         
-        logger.info(f"Extraction completed:")
-        logger.info(f"   Processed: {processed_count}, Failed: {failed_count}")
-        logger.info(f"   Success rate: {(processed_count/frame_count)*100:.1f}%")
+        if not max_width or width <= max_width:
+            return shape
         
-        return {
-            'metadata': metadata,
-            'poses': poses
-        }
+        return (max(1, round(height * max_width / width)), max_width) + tuple(shape[2:])
     
-    def _process_frame(self, frame, frame_number: int, fps: float) -> Optional[Dict]:
-        """Process individual frame and extract landmarks with angles"""
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    def _to_mp_image(self, frame, is_rgb: bool = False) -> mp.Image:
+        """Convert a BGR (or already RGB) frame to an mp.Image, reusing the frame buffers across frames"""
+        if self._frame_shape != frame.shape:
+            shape = self._preprocess_shape(frame.shape)
+            self._frame_shape = frame.shape
+            self._resize_buf = np.empty(shape, dtype=np.uint8) if shape != frame.shape else None
+            self._rgb_buf = np.empty(shape, dtype=np.uint8)
+            self._flip_buf = np.empty(shape, dtype=np.uint8) if Config.MIRROR_REFERENCE else None
+        
+        # Opt-in speed/accuracy trade: the landmark model runs on a crop around
+        # the person taken from this image, so a smaller frame means a
+        # lower-resolution crop (upsampled when the person spans fewer than
+        # 256 px) and less accurate landmarks. Done first, it makes the color
+        # conversion, flip and copy into mp.Image cheaper.
+        if self._resize_buf is not None:
+            height, width = self._resize_buf.shape[:2]
+            frame = cv2.resize(frame, (width, height), dst=self._resize_buf, interpolation=cv2.INTER_AREA)
+        
+        if is_rgb:
+            frame_rgb = frame
+        else:
+            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self._rgb_buf)
         
         # Mirror if configured
         if Config.MIRROR_REFERENCE:
-            frame_rgb = cv2.flip(frame_rgb, 1)
+            frame_rgb = cv2.flip(frame_rgb, 1, dst=self._flip_buf)
         
-        mp_image = mp.Image(
+        # mp.Image copies the pixels, so the buffer can be overwritten next frame
+        return mp.Image(
             image_format=mp.ImageFormat.SRGB,
             data=frame_rgb
         )
-        
+    
+    def _process_frame(self, mp_image: mp.Image, frame_number: int, fps: float) -> Optional[Dict]:
+        """Process individual frame and extract landmarks with angles"""
         timestamp_ms = int(frame_number / fps * 1000) if fps > 0 else frame_number * 33
         
-        detection_result = self.detector.detect_for_video(mp_image, timestamp_ms)
+        detection_result = self._detect(mp_image, timestamp_ms)
         
         if not detection_result.pose_landmarks or len(detection_result.pose_landmarks) == 0:
             return None
         
-        pose_landmarks = detection_result.pose_landmarks[0]
+        all_lm = pack_landmarks(detection_result.pose_landmarks[0], out=self._lm_buf)
         timestamp = frame_number / fps if fps > 0 else 0
         
-        # Serialize landmarks (only active ones)
-        landmarks = self._serialize_landmarks(pose_landmarks)
-        
         # Calculate angles
-        angles = self._calculate_angles(landmarks)
-        
-
+        angles = self._calculate_angles(all_lm)
         
+        # Values stay unrounded float32 arrays; pose_to_json() converts them at save time
         return {
-            'timestamp': round(timestamp, 3),
+            'timestamp': timestamp,
             'frame': frame_number,
-            'landmarks': landmarks,
+            'landmarks': all_lm[self._active_idx],
             'angles': angles
         }
     
-    def _serialize_landmarks(self, pose_landmarks) -> List[Dict]:
-        """Convert MediaPipe landmarks to JSON format (only active landmarks)"""
-        landmarks = []
-        
-        # Explicitly filter to only active landmarks to avoid issues with missing points
-        for i in Config.ACTIVE_LANDMARKS:
-            if i < len(pose_landmarks):
-                landmark = pose_landmarks[i]
-                landmarks.append({
-                    'id': i,
-                    'x': round(landmark.x, 4),
-                    'y': round(landmark.y, 4),
-                    'z': round(landmark.z, 4),
-                    'visibility': round(landmark.visibility, 4)
-                })
-        
-        return landmarks
-    
-    def _calculate_angles(self, landmarks: List[Dict]) -> Dict[str, float]:
-        """Calculate joint angles"""
-        angles = {}
-        
-        # Create lookup dict by ID
-        landmark_dict = {lm['id']: lm for lm in landmarks}
-        
-        for angle_name, (p1_id, vertex_id, p2_id) in Config.ANGLE_JOINTS.items():
-            if all(id in landmark_dict for id in [p1_id, vertex_id, p2_id]):
-                p1 = landmark_dict[p1_id]
-                vertex = landmark_dict[vertex_id]
-                p2 = landmark_dict[p2_id]
-                
-                # Only calculate if all points are visible
-                if all(pt['visibility'] > 0.5 for pt in [p1, vertex, p2]):
-                    angle = self._compute_angle(
-                        (p1['x'], p1['y'], p1['z']),
-                        (vertex['x'], vertex['y'], vertex['z']),
-                        (p2['x'], p2['y'], p2['z'])
-                    )
-                    angles[angle_name] = round(angle, 2)
-                else:
-                    angles[angle_name] = None
-            else:
-                angles[angle_name] = None
+    def _calculate_angles(self, all_lm: np.ndarray) -> np.ndarray:
+        """
+        Calculate all joint angles at once from the (33, 4) landmark array.
+        Angles are 2D (camera view), ignoring depth (z).
         
-        return angles
-    
-    def _compute_angle(self, p1: Tuple[float, float, float], 
-                    vertex: Tuple[float, float, float],
-                    p2: Tuple[float, float, float]) -> float:
-        """Compute angle at vertex between p1-vertex-p2 (2D for camera view). Ignoring depth (z) for angle calculation."""
-        v1 = np.array([p1[0] - vertex[0], p1[1] - vertex[1]])
-        v2 = np.array([p2[0] - vertex[0], p2[1] - vertex[1]])
+        Returns:
+            float32 array in ANGLE_JOINTS order, NaN where an angle is not computed
+        """
+        angles = np.full(len(self._angle_names), np.nan, dtype=np.float32)
+        angles_deg = compute_angles(all_lm[:, :2], self._angle_idx, out=self._angle_buf)
         
-        # Angle using dot product
-        cos_angle = np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2) + 1e-8)
-        cos_angle = np.clip(cos_angle, -1.0, 1.0)
-        angle_rad = np.arccos(cos_angle)
-        angle_deg = np.degrees(angle_rad)
+        # Only keep angles whose points are all visible
+        visible = (all_lm[self._angle_idx, 3] > 0.5).all(axis=1)
+        angles[self._angle_pos] = np.where(visible, angles_deg, np.float32(np.nan))
         
-        return angle_deg
-    
+        return angles
     
     def extract_from_frame(self, frame, timestamp_ms: int = 0) -> Optional[Dict]:
         """
@@ -285,22 +802,18 @@ class PoseExtractor:
         Returns:
             Dict with landmarks and angles or None
         """
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        mp_image = self._to_mp_image(frame)
         
-        if Config.MIRROR_REFERENCE:
-            frame_rgb = cv2.flip(frame_rgb, 1)
-        
-        mp_image = mp.Image(
-            image_format=mp.ImageFormat.SRGB,
-            data=frame_rgb
-        )
+        # Caller-managed timestamps may go backwards (e.g. a restarted stream)
+        if self._ts_offset_ms + timestamp_ms <= _last_timestamp_ms.get(id(self.detector), -1):
+            self.reset()
         
-        detection_result = self.detector.detect_for_video(mp_image, timestamp_ms)
+        detection_result = self._detect(mp_image, timestamp_ms)
         
         if detection_result.pose_landmarks and len(detection_result.pose_landmarks) > 0:
-            pose_landmarks = detection_result.pose_landmarks[0]
-            landmarks = self._serialize_landmarks(pose_landmarks)
-            angles = self._calculate_angles(landmarks)
+            all_lm = pack_landmarks(detection_result.pose_landmarks[0], out=self._lm_buf)
+            landmarks = landmarks_to_json(all_lm[self._active_idx], self.active_landmark_ids)
+            angles = angles_to_json(self._calculate_angles(all_lm))
 
             
             return {
@@ -311,9 +824,91 @@ class PoseExtractor:
         return None
     
     def __del__(self):
-        """Cleanup"""
-        if hasattr(self, 'detector'):
-            self.detector.close()
+        """Cleanup (shared detectors stay open for other extractors)"""
+        self._close_detector()
+
+
+def _hardware_key() -> str:
+    """Short hash identifying the current CPU, used to key calibration results."""
+    ident = f"{platform.processor()}|{platform.machine()}|{os.cpu_count()}"
+    return hashlib.sha1(ident.encode('utf-8')).hexdigest()[:12]
+
+
+def calibrate_model_complexity(video_path: str, target_fps: Optional[float] = None,
+                               runs: int = 5) -> str:
+    """
+    Pick the most accurate model that keeps up with a target FPS on this machine.
+    
+    Each complexity is timed on a frame taken from the middle of the video
+    (a blank frame would only exercise the person detector, which is shared by
+    all variants). The result is cached in CALIBRATION_FILE keyed by hardware
+    and the settings that change per-frame cost, so the probe only runs again
+    when those change. Probe models are closed once timed rather than kept
+    in the shared landmarker cache.
+    
+    Args:
+        video_path: Video used to grab a representative frame
+        target_fps: FPS budget (None = use Config.AUTO_COMPLEXITY_TARGET_FPS)
+        runs: Timed inferences per model
+    
+    Returns:
+        'lite', 'full', or 'heavy'
+    """
+    Config.ensure_loaded()
+    if target_fps is None:
+        target_fps = Config.AUTO_COMPLEXITY_TARGET_FPS
+    
+    cache_path = Path(CALIBRATION_FILE)
+    cache = {}
+    if cache_path.exists():
+        with cache_path.open('r', encoding='utf-8') as f:
+            cache = json.load(f)
+    
+    key = (f"{_hardware_key()}@{target_fps}"
+           f"|gpu={int(bool(Config.USE_GPU_DELEGATE))}|max_width={Config.PREPROCESS_MAX_WIDTH}")
+    if key in cache:
+        logger.info("Using calibrated model complexity: %s", cache[key])
+        return cache[key]
+    
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) // 2)
+    ret, frame = cap.read()
+    cap.release()
+    if not ret:
+        raise ValueError(f"Could not read a calibration frame from: {video_path}")
+    
+    budget_ms = 1000.0 / target_fps
+    selected = MODEL_COMPLEXITIES[0]
+    
+    for complexity in MODEL_COMPLEXITIES:
+        try:
+            extractor = PoseExtractor(model_path=f'pose_landmarker_{complexity}.task',
+                                      model_complexity=complexity,
+                                      shared_detector=False)
+        except FileNotFoundError:
+            logger.warning("Skipping %s model in calibration (not found)", complexity)
+            continue
+        
+        timings = []
+        try:
+            for i in range(runs):
+                start = time.perf_counter()
+                extractor.extract_from_frame(frame, timestamp_ms=i * 33)
+                timings.append((time.perf_counter() - start) * 1000)
+        finally:
+            extractor.close()
+        median_ms = statistics.median(timings)
+        
+        logger.info("   Calibration %s: %.1f ms/frame (budget %.1f ms)", complexity, median_ms, budget_ms)
+        if median_ms <= budget_ms:
+            selected = complexity
+    
+    cache[key] = selected
+    with cache_path.open('w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=2)
+    
+    logger.info("Calibrated model complexity: %s", selected)
+    return selected
 
 
 if __name__ == "__main__":
@@ -327,8 +922,12 @@ if __name__ == "__main__":
     
     try:
         Config.load()
-        extractor = PoseExtractor()
+        model_complexity = Config.MODEL_COMPLEXITY
+        if model_complexity == 'auto':
+            model_complexity = calibrate_model_complexity(video_path)
+        extractor = PoseExtractor(model_complexity=model_complexity)
         data = extractor.extract_from_video(video_path)
+        data['poses'] = [pose_to_json(pose, extractor.active_landmark_ids) for pose in data['poses']]
         
         output_path = "test_extraction.json"
         with open(output_path, 'w') as f:
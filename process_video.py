@@ -4,13 +4,26 @@ Extracts continuous pose data from choreography videos.
 """
 
 import argparse
+import cv2
+import csv
 import json
 import logging
+import multiprocessing
+import os
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
 import sys
 
-from pose_extractor import PoseExtractor
+try:
+    import orjson
+except ImportError:  # Optional: faster JSON encoding for large choreographies
+    orjson = None
+
+from pose_extractor import (
+    NPZ_PRECISIONS, PoseExtractor, QuantizedPoses, calibrate_model_complexity, pose_to_json
+)
 from config import Config
 
 logging.basicConfig(
@@ -21,20 +34,47 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def _dumps(obj) -> bytes:
+    """Compact UTF-8 JSON encoding used for the streamed choreography file"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
 class ChoreographyProcessor:
     """
     Process choreography videos into continuous pose data.
     """
     
-    def __init__(self, model_complexity: str = None):
+    def __init__(self, model_complexity: str = None, output_dir: str = None,
+                 decode_threads: int = None):
         """
         Args:
-            model_complexity: 'lite', 'full', or 'heavy'
+            model_complexity: 'lite', 'full', 'heavy', or 'auto' (calibrated
+                on the first processed video)
+            output_dir: Default output directory (default: Config.OUTPUT_DIR)
+            decode_threads: FFmpeg threads for the PyAV decoder (default: half the CPUs)
         """
         self.model_complexity = model_complexity or Config.MODEL_COMPLEXITY
+        self._decode_threads = decode_threads
         
+        # Created once here rather than for every saved video
+        self.output_path = Path(output_dir or Config.OUTPUT_DIR)
+        self.output_path.mkdir(parents=True, exist_ok=True)
+        
+        # 'auto' needs a video to calibrate on; the extractor is built on first use then
+        self.extractor = None
+        if self.model_complexity != 'auto':
+            self._create_extractor()
+    
+    def _create_extractor(self) -> None:
+        """Build the PoseExtractor for self.model_complexity"""
         try:
-            self.extractor = PoseExtractor(model_complexity=self.model_complexity)
+            # Processors in one process handle videos one after another, so
+            # they can share the loaded model
+            self.extractor = PoseExtractor(model_complexity=self.model_complexity,
+                                           decode_threads=self._decode_threads,
+                                           shared_detector=True)
         except FileNotFoundError as e:
             logger.error("Model not found:")
             logger.error(str(e))
@@ -45,7 +85,9 @@ class ChoreographyProcessor:
                      name: str,
                      source_url: str = "",
                      output_dir: str = None,
-                     skip_frames: int = None) -> str:
+                     skip_frames: int = None,
+                     binary: bool = False,
+                     precision: str = 'i16') -> str:
         """
         Process video into continuous choreography data.
         
@@ -53,71 +95,75 @@ class ChoreographyProcessor:
             video_path: Path to video file
             name: Choreography name
             source_url: Original video URL
-            output_dir: Output directory (default: Config.OUTPUT_DIR)
+            output_dir: Output directory (default: the processor's output_dir)
             skip_frames: Skip N frames (default: Config.SKIP_FRAMES)
+            binary: Also write a quantized .npz copy of the poses next to the JSON
+            precision: Storage type of the .npz arrays ('i16', 'f16' or 'f32')
         
         Returns:
             Path to generated JSON file
         """
+        processed_at = datetime.now().isoformat()
+        
         if output_dir is None:
-            output_dir = Config.OUTPUT_DIR
+            output_path = self.output_path
+        else:
+            output_path = Path(output_dir)
+            output_path.mkdir(parents=True, exist_ok=True)
         
         if skip_frames is None:
             skip_frames = Config.SKIP_FRAMES
         
+        if self.extractor is None:
+            self.model_complexity = calibrate_model_complexity(video_path)
+            self._create_extractor()
+        
         logger.info("="*70)
-        logger.info(f"PROCESSING: {name}")
-        logger.info(f"   Model: {self.model_complexity}")
-        logger.info(f"   Skip frames: {skip_frames}")
+        logger.info("PROCESSING: %s", name)
+        logger.info("   Model: %s", self.model_complexity)
+        logger.info("   Skip frames: %d", skip_frames)
         logger.info("="*70)
         
+        metadata = self.extractor.read_metadata(video_path)
+        
+        # Build choreography metadata; poses are streamed to disk as they are extracted
+        choreography_metadata = {
+            'name': name,
+            'source_url': source_url,
+            'duration': metadata['duration'],
+            'fps': metadata['fps'],
+            'resolution': metadata['resolution'],
+            'total_frames': metadata['total_frames'],
+            'processed_at': processed_at,
+            'processing_params': {
+                'model_complexity': self.model_complexity,
+                'skip_frames': skip_frames,
+                'active_landmarks': Config.ACTIVE_LANDMARKS,
+                'mirror_mode': Config.MIRROR_REFERENCE
+            }
+        }
+        
         # Extract poses
         logger.info("\nExtracting poses...")
-        extraction_data = self.extractor.extract_from_video(
-            video_path,
-            skip_frames=skip_frames
-        )
+        poses = self.extractor.iter_poses(video_path, skip_frames=skip_frames)
         
-        poses = extraction_data['poses']
-        metadata = extraction_data['metadata']
+        # Save
+        output_path, stats = self._save_choreography(
+            choreography_metadata, poses, name, output_path,
+            binary=binary, precision=precision,
+            expected_poses=self.extractor.max_poses(metadata, skip_frames)
+        )
         
-        if not poses:
+        if output_path is None:
             logger.error("No poses extracted")
             sys.exit(1)
         
-        # Calculate statistics
-        stats = self._calculate_stats(poses, metadata)
-        
-        # Build choreography object
-        choreography = {
-            'metadata': {
-                'name': name,
-                'source_url': source_url,
-                'duration': metadata['duration'],
-                'fps': metadata['fps'],
-                'resolution': metadata['resolution'],
-                'total_frames': metadata['total_frames'],
-                'processed_at': datetime.now().isoformat(),
-                'processing_params': {
-                    'model_complexity': self.model_complexity,
-                    'skip_frames': skip_frames,
-                    'active_landmarks': Config.ACTIVE_LANDMARKS,
-                    'mirror_mode': Config.MIRROR_REFERENCE
-                }
-            },
-            'poses': poses,
-            'stats': stats
-        }
-        
-        # Save
-        output_path = self._save_choreography(choreography, name, output_dir)
-        self._print_summary(choreography, output_path)
+        self._print_summary(choreography_metadata, stats, output_path)
         
         return output_path
     
-    def _calculate_stats(self, poses: list, metadata: dict) -> dict:
+    def _calculate_stats(self, total_poses: int, metadata: dict) -> dict:
         """Calculate statistics"""
-        total_poses = len(poses)
         duration = metadata['duration']
         fps_effective = total_poses / duration if duration > 0 else 0
         
@@ -129,89 +175,301 @@ class ChoreographyProcessor:
             'duration': duration
         }
     
-    def _save_choreography(self, choreography: dict, name: str, 
-                          output_dir: str) -> str:
-        """Save choreography JSON"""
-        output_path = Path(output_dir)
-        output_path.mkdir(parents=True, exist_ok=True)
+    def _save_choreography(self, metadata: dict, poses: Iterable[dict], name: str,
+                          output_path: Path, binary: bool = False, precision: str = 'i16',
+                          expected_poses: int = 0) -> Tuple[Optional[str], dict]:
+        """
+        Stream choreography JSON to disk: metadata header, each pose as it
+        arrives, then the stats footer. Written compact to a temporary file
+        that replaces the target only if at least one pose was extracted.
+        With binary, the poses are also saved at the given precision to a
+        .npz file of the same name, collected in arrays preallocated for
+        expected_poses.
         
+        Returns:
+            (path to JSON file or None if no poses, stats)
+        """
         # Clean filename
         filename = name.lower().replace(' ', '_').replace('-', '_')
         filename = ''.join(c for c in filename if c.isalnum() or c == '_')
         filename = f"{filename}.json"
         
         full_path = output_path / filename
+        tmp_path = full_path.with_name(full_path.name + '.tmp')
+        npz_path = full_path.with_suffix('.npz')
+        npz_tmp_path = npz_path.with_name(npz_path.name + '.tmp')
+        landmark_ids = self.extractor.active_landmark_ids
+        quantized = QuantizedPoses(landmark_ids, precision, capacity=expected_poses) if binary else None
+        total_poses = 0
         
-        with open(full_path, 'w', encoding='utf-8') as f:
-            json.dump(choreography, f, indent=2, ensure_ascii=False)
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(b'{"metadata":')
+                f.write(_dumps(metadata))
+                f.write(b',"poses":[')
+                
+                for pose in poses:
+                    if total_poses:
+                        f.write(b',')
+                    f.write(_dumps(pose_to_json(pose, landmark_ids)))
+                    if quantized is not None:
+                        quantized.append(pose)
+                    total_poses += 1
+                
+                stats = self._calculate_stats(total_poses, metadata)
+                f.write(b'],"stats":')
+                f.write(_dumps(stats))
+                f.write(b'}')
+            
+            if quantized is not None and total_poses:
+                with open(npz_tmp_path, 'wb') as f:
+                    quantized.save(f)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            npz_tmp_path.unlink(missing_ok=True)
+            raise
+        
+        if total_poses == 0:
+            tmp_path.unlink()
+            return None, stats
         
-        return str(full_path)
+        os.replace(tmp_path, full_path)
+        if quantized is not None:
+            os.replace(npz_tmp_path, npz_path)
+            logger.info("Quantized poses saved to: %s", npz_path)
+        return str(full_path), stats
     
-    def _print_summary(self, choreography: dict, output_path: str):
+    def _print_summary(self, metadata: dict, stats: dict, output_path: str):
         """Print processing summary"""
-        metadata = choreography['metadata']
-        stats = choreography['stats']
-        
         logger.info("\n" + "="*70)
         logger.info("PROCESSING COMPLETED")
         logger.info("="*70)
-        logger.info(f"\nName: {metadata['name']}")
-        logger.info(f"Duration: {metadata['duration']:.1f}s")
-        logger.info(f"Total poses: {stats['total_poses']}")
-        logger.info(f"Effective FPS: {stats['fps_effective']:.1f}")
-        logger.info(f"\nSaved to: {output_path}")
+        logger.info("\nName: %s", metadata['name'])
+        logger.info("Duration: %.1fs", metadata['duration'])
+        logger.info("Total poses: %d", stats['total_poses'])
+        logger.info("Effective FPS: %.1f", stats['fps_effective'])
+        logger.info("\nSaved to: %s", output_path)
         logger.info("="*70 + "\n")
 
 
+# Per-process ChoreographyProcessor used by batch workers
+_worker_processor: Optional[ChoreographyProcessor] = None
+
+
+def _worker_init(config_path: str, model_complexity: str, output_dir: Optional[str],
+                 thread_budget: int) -> None:
+    """Batch worker initializer: load config and build a process-local processor"""
+    global _worker_processor
+    
+    # Every worker decodes and runs inference at once, so each one keeps its
+    # OpenCV and FFmpeg thread pools within its share of the CPUs
+    cv2.setNumThreads(thread_budget)
+    
+    Config.load(config_path)
+    _worker_processor = ChoreographyProcessor(model_complexity=model_complexity, output_dir=output_dir,
+                                              decode_threads=max(1, thread_budget // 2))
+
+
+def _worker_process(job: dict) -> str:
+    """Batch worker task: process one video with the process-local processor"""
+    return _worker_processor.process_video(**job)
+
+
+def read_batch_file(batch_path: str) -> List[dict]:
+    """Read a batch CSV with rows: video_path,name[,source_url]"""
+    jobs = []
+    with open(batch_path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if not row or row[0].strip().startswith('#'):
+                continue
+            if len(row) < 2:
+                raise ValueError(f"Batch row needs at least video_path,name: {row}")
+            jobs.append({
+                'video_path': row[0].strip(),
+                'name': row[1].strip(),
+                'source_url': row[2].strip() if len(row) > 2 else ''
+            })
+    return jobs
+
+
+def process_videos(jobs: List[dict],
+                   config_path: str = 'config.json',
+                   model_complexity: str = None,
+                   output_dir: str = None,
+                   skip_frames: int = None,
+                   max_workers: int = None,
+                   binary: bool = False,
+                   precision: str = 'i16') -> List[Optional[str]]:
+    """
+    Process several videos in parallel, one ChoreographyProcessor per worker process.
+    
+    Args:
+        jobs: Dicts with video_path, name and optional source_url
+        config_path: Config file loaded here and by every worker
+        model_complexity: 'lite', 'full', 'heavy', or 'auto' (calibrated once
+            on the first video; default: Config.MODEL_COMPLEXITY)
+        output_dir: Output directory (default: Config.OUTPUT_DIR)
+        skip_frames: Skip N frames (default: Config.SKIP_FRAMES)
+        max_workers: Worker processes (default: half the CPUs, at most one per job)
+        binary: Also write a quantized .npz copy of each choreography
+        precision: Storage type of the .npz arrays ('i16', 'f16' or 'f32')
+    
+    Returns:
+        Output path per job, None where processing failed
+    """
+    if max_workers is None:
+        max_workers = min((os.cpu_count() or 2) // 2, len(jobs))
+    max_workers = max(1, max_workers)
+    thread_budget = max(1, (os.cpu_count() or 2) // max_workers)
+    
+    # The default complexity and 'auto' calibration must follow the same
+    # config as the workers, not whatever this process loaded before
+    Config.load(config_path)
+    
+    # Resolved here so the workers share one calibration instead of each
+    # failing (or calibrating) on its own
+    model_complexity = model_complexity or Config.MODEL_COMPLEXITY
+    if model_complexity == 'auto':
+        model_complexity = calibrate_model_complexity(jobs[0]['video_path'])
+    
+    results: List[Optional[str]] = [None] * len(jobs)
+    
+    logger.info("Batch processing %d videos with %d workers", len(jobs), max_workers)
+    
+    # Spawn, not fork: the parent may hold live MediaPipe landmarkers (e.g.
+    # from calibration) in the _make_landmarker cache, and a forked child
+    # would reuse them without their graph threads and deadlock.
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_worker_init,
+                             initargs=(config_path, model_complexity, output_dir, thread_budget)) as executor:
+        futures = {
+            executor.submit(_worker_process, {
+                **job,
+                'skip_frames': skip_frames,
+                'binary': binary,
+                'precision': precision
+            }): i
+            for i, job in enumerate(jobs)
+        }
+        
+        for future in as_completed(futures):
+            job = jobs[futures[future]]
+            try:
+                results[futures[future]] = future.result()
+            except (Exception, SystemExit) as e:
+                logger.error("Failed: %s (%s): %r", job['name'], job['video_path'], e)
+    
+    return results
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Clone Dance - Video Processor',
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
     
-    parser.add_argument('--video', required=True, help='Video file (MP4)')
-    parser.add_argument('--name', required=True, help='Choreography name')
+    parser.add_argument('--video', help='Video file (MP4)')
+    parser.add_argument('--name', help='Choreography name')
+    parser.add_argument('--batch', default=None,
+                       help='CSV file with rows video_path,name[,url] to process in parallel')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='Worker processes for --batch (default: half the CPUs)')
     parser.add_argument('--url', default='', help='Source URL')
     parser.add_argument('--output-dir', default=None, help='Output directory (default: config.json)')
-    parser.add_argument('--model-complexity', choices=['lite', 'full', 'heavy'], 
+    parser.add_argument('--model-complexity', choices=['lite', 'full', 'heavy', 'auto'], 
                        default=None, help='Model complexity (default: config.json)')
     parser.add_argument('--skip-frames', type=int, default=None,
                        help='Skip N frames (default: config.json)')
+    parser.add_argument('--binary', action='store_true',
+                       help='Also save a quantized .npz copy of the poses next to the JSON')
+    parser.add_argument('--precision', choices=NPZ_PRECISIONS, default=None,
+                       help='Storage type of the .npz copy (default: i16; implies --binary)')
     parser.add_argument('--config', default='config.json', help='Config file path')
     
     args = parser.parse_args()
     
+    if args.precision is not None:
+        args.binary = True
+    else:
+        args.precision = 'i16'
+    
+    if args.batch is None and (args.video is None or args.name is None):
+        parser.error('--video and --name are required unless --batch is given')
+    
     # Load config
     Config.load(args.config)
     
+    if args.batch is not None:
+        sys.exit(_run_batch(args))
+    
     if not Path(args.video).exists():
-        logger.error(f"Video not found: {args.video}")
+        logger.error("Video not found: %s", args.video)
         sys.exit(1)
     
     try:
         processor = ChoreographyProcessor(
-            model_complexity=args.model_complexity
+            model_complexity=args.model_complexity,
+            output_dir=args.output_dir
         )
         
         output_path = processor.process_video(
             video_path=args.video,
             name=args.name,
             source_url=args.url,
-            output_dir=args.output_dir,
-            skip_frames=args.skip_frames
+            skip_frames=args.skip_frames,
+            binary=args.binary,
+            precision=args.precision
         )
         
-        logger.info(f"Success! {output_path}\n")
+        logger.info("Success! %s\n", output_path)
         
     except KeyboardInterrupt:
         logger.info("\nInterrupted")
         sys.exit(1)
     except Exception as e:
-        logger.error(f"\nError: {e}")
+        logger.error("\nError: %s", e)
         import traceback
         logger.debug(traceback.format_exc())
         sys.exit(1)
 
 
+def _run_batch(args) -> int:
+    """Run --batch mode; returns the process exit code"""
+    try:
+        jobs = read_batch_file(args.batch)
+    except (OSError, ValueError) as e:
+        logger.error("Invalid batch file: %s", e)
+        return 1
+    
+    if not jobs:
+        logger.error("No videos listed in: %s", args.batch)
+        return 1
+    
+    missing = [job['video_path'] for job in jobs if not Path(job['video_path']).exists()]
+    if missing:
+        logger.error("Videos not found: %s", ', '.join(missing))
+        return 1
+    
+    try:
+        results = process_videos(
+            jobs,
+            config_path=args.config,
+            model_complexity=args.model_complexity,
+            output_dir=args.output_dir,
+            skip_frames=args.skip_frames,
+            max_workers=args.workers,
+            binary=args.binary,
+            precision=args.precision
+        )
+    except KeyboardInterrupt:
+        logger.info("\nInterrupted")
+        return 1
+    
+    succeeded = sum(1 for path in results if path)
+    logger.info("Batch completed: %d/%d succeeded", succeeded, len(jobs))
+    return 0 if succeeded == len(jobs) else 1
+
+
 if __name__ == "__main__":
     main()